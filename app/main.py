@@ -1,14 +1,17 @@
 # app/main.py
 import os
+from collections import OrderedDict
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from supabase.client import Client, create_client
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_community.vectorstores.supabase import SupabaseVectorStore
-from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
 from langchain.prompts import PromptTemplate
 from fastapi.middleware.cors import CORSMiddleware # Ajout pour la gestion des CORS
+from app.semantic_cache import SemanticCache
+from app.vector_store import ThresholdSupabaseVectorStore
 
 # --- Étape 1: Chargement des variables d'environnement ---
 print("Chargement des variables d'environnement...")
@@ -24,7 +27,8 @@ print(f"OPENAI_API_KEY: {'Set' if openai_api_key else 'Missing'}")
 
 # --- Étape 5: Création de l'application API avec FastAPI ---
 print("Création de l'application FastAPI...")
-app = FastAPI()
+# orjson pour une sérialisation JSON plus rapide des réponses
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Configuration des CORS pour autoriser l'application mobile à appeler l'API
 app.add_middleware(
@@ -55,8 +59,54 @@ def test_environment():
 def read_root():
     return {"message": "SuperDog Backend is running!"}
 
+# --- Étape 3: Définition du Prompt pour guider l'IA ---
+# C'est le "rôle" que l'on donne à SuperDog. C'est très important.
+# La partie fixe (le rôle) est une constante ; seuls {context} et {question} sont
+# interpolés à chaque requête. Le template est compilé une seule fois, au démarrage.
+SYSTEM_PREAMBLE = """
+        Tu es SuperDog, un assistant IA amical, positif et bienveillant, expert du monde canin.
+        Ton but est d'aider les propriétaires de chiens en leur donnant des conseils clairs, simples et rassurants.
+        Utilise uniquement les informations de contexte suivantes pour répondre à la question. Ne réponds pas si la question sort de ce contexte.
+        Ton ton doit être encourageant. N'utilise jamais de termes techniques ou compliqués.
+        Termine toujours tes réponses importantes par la phrase : "N'oubliez pas, SuperDog est un guide et ne remplace pas l'avis d'un vétérinaire."
+"""
+
+PROMPT_SUFFIX = """
+        Contexte : {context}
+
+        Question : {question}
+
+        Réponse amicale :"""
+
+PROMPT = PromptTemplate(
+    template=SYSTEM_PREAMBLE + PROMPT_SUFFIX, input_variables=["context", "question"]
+)
+
 # Initialisation conditionnelle des services
-qa_chain = None
+answer_chain = None
+
+# Cache sémantique des réponses (questions proches => même réponse, sans appel OpenAI)
+answer_cache = SemanticCache(dim=1536, maxlen=500, ttl=300)
+
+def _normalize_question(question: str) -> str:
+    return " ".join(question.strip().lower().split())
+
+# Mémoïsation LRU des embeddings : une question identique ne repasse pas par l'API OpenAI
+# (functools.lru_cache ne sait pas mémoïser le résultat d'une coroutine)
+_embedding_cache = OrderedDict()
+_EMBEDDING_CACHE_SIZE = 2048
+
+async def _embed(question: str) -> tuple:
+    vector = _embedding_cache.get(question)
+    if vector is not None:
+        _embedding_cache.move_to_end(question)
+        return vector
+
+    vector = tuple(await embeddings.aembed_query(question))
+    _embedding_cache[question] = vector
+    if len(_embedding_cache) > _EMBEDDING_CACHE_SIZE:
+        _embedding_cache.popitem(last=False)
+    return vector
 
 if all([supabase_url, supabase_key, openai_api_key]):
     try:
@@ -73,53 +123,30 @@ if all([supabase_url, supabase_key, openai_api_key]):
 
         # Connexion à notre base de données vectorielle Supabase
         # C'est ici que nous nous connectons à la connaissance de SuperDog
-        vector_store = SupabaseVectorStore(
+        # Les documents sous le seuil de similarité (0.35) sont écartés directement par Supabase
+        vector_store = ThresholdSupabaseVectorStore(
             client=supabase_client,
             embedding=embeddings,
             table_name="documents",
-            query_name="match_documents"
+            query_name="match_documents",
+            match_threshold=0.35
         )
 
-        # --- Étape 3: Définition du Prompt pour guider l'IA ---
-        # C'est le "rôle" que l'on donne à SuperDog. C'est très important.
-        prompt_template = """
-        Tu es SuperDog, un assistant IA amical, positif et bienveillant, expert du monde canin.
-        Ton but est d'aider les propriétaires de chiens en leur donnant des conseils clairs, simples et rassurants.
-        Utilise uniquement les informations de contexte suivantes pour répondre à la question. Ne réponds pas si la question sort de ce contexte.
-        Ton ton doit être encourageant. N'utilise jamais de termes techniques ou compliqués.
-        Termine toujours tes réponses importantes par la phrase : "N'oubliez pas, SuperDog est un guide et ne remplace pas l'avis d'un vétérinaire."
-
-        Contexte : {context}
-
-        Question : {question}
-
-        Réponse amicale :"""
-
-        PROMPT = PromptTemplate(
-            template=prompt_template, input_variables=["context", "question"]
-        )
-
-        # --- Étape 4: Création de la chaîne RAG (Retrieval-Augmented Generation) ---
-        # C'est le coeur de notre système. LangChain s'occupe de tout :
-        # 1. Prendre la question de l'utilisateur.
-        # 2. La transformer en vecteur et trouver les documents similaires dans Supabase (le "retrieval").
-        # 3. Injecter ces documents dans le prompt.
-        # 4. Envoyer le tout au LLM pour qu'il génère la réponse.
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=vector_store.as_retriever(),
-            chain_type_kwargs={"prompt": PROMPT},
-            return_source_documents=True # Pour vérifier si des documents ont été trouvés
-        )
+        # --- Étape 4: Création de la chaîne de réponse (RAG) ---
+        # Le "retrieval" est fait dans /ask : la question y est transformée en vecteur
+        # (une seule fois, réutilisé par les caches) puis les documents similaires sont
+        # cherchés dans Supabase. Cette chaîne "stuff" se charge du reste :
+        # 1. Injecter ces documents dans le prompt.
+        # 2. Envoyer le tout au LLM pour qu'il génère la réponse.
+        answer_chain = load_qa_chain(llm, chain_type="stuff", prompt=PROMPT)
         print("Services initialisés avec succès!")
     except Exception as e:
         print(f"Erreur lors de l'initialisation des services: {e}")
-        qa_chain = None
+        answer_chain = None
 
 # Endpoint principal pour poser des questions
 @app.post("/ask")
-def ask_superdog(query: Query):
+async def ask_superdog(query: Query):
     """
     Reçoit une question de l'application mobile, la traite avec la chaîne RAG
     et retourne la réponse de SuperDog.
@@ -127,20 +154,38 @@ def ask_superdog(query: Query):
     if not all([supabase_url, supabase_key, openai_api_key]):
         raise HTTPException(status_code=500, detail="Backend not properly configured. Missing environment variables.")
     
-    if qa_chain is None:
+    if answer_chain is None:
         raise HTTPException(status_code=500, detail="Backend services not initialized.")
     
     try:
         print(f"Question reçue: {query.question}")
-        result = qa_chain.invoke({"query": query.question})
+
+        # Un seul embedding par question, réutilisé pour le cache et pour la recherche Supabase
+        normalized_question = _normalize_question(query.question)
+        question_embedding = list(await _embed(normalized_question))
+
+        cached_answer = answer_cache.get(question_embedding, tau=0.85, key=normalized_question)
+        if cached_answer is not None:
+            print("Réponse trouvée dans le cache sémantique.")
+            return {"answer": cached_answer}
+
+        source_documents = await vector_store.asimilarity_search_by_vector(question_embedding)
         
-        # Si la recherche dans Supabase n'a retourné aucun document pertinent (score < 0.35)
-        if not result["source_documents"]:
+        # Si la recherche dans Supabase n'a retourné aucun document pertinent (score < 0.35),
+        # on répond directement sans appeler le LLM
+        if not source_documents:
             print("Aucun document pertinent trouvé. Réponse générique.")
             return {"answer": "Hum, cette question est un peu pointue ! Pour la santé et la sécurité de votre compagnon, je vous recommande de consulter directement un vétérinaire. Il saura vous donner la meilleure réponse."}
 
-        print(f"Réponse générée: {result['result']}")
-        return {"answer": result["result"]}
+        # On passe directement les documents trouvés à la chaîne "stuff"
+        result = await answer_chain.ainvoke(
+            {"input_documents": source_documents, "question": query.question}
+        )
+        answer = result["output_text"]
+        answer_cache.put(question_embedding, answer, key=normalized_question)
+
+        print(f"Réponse générée: {answer}")
+        return {"answer": answer}
     except Exception as e:
         print(f"Erreur lors du traitement de la question: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing question: {str(e)}")
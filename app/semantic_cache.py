@@ -0,0 +1,128 @@
+# app/semantic_cache.py
+import time
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Cache sémantique en mémoire pour les réponses de SuperDog.
+    Les embeddings des questions déjà posées sont indexés dans FAISS (produit
+    scalaire sur vecteurs normalisés = similarité cosinus). Une question proche
+    d'une question déjà traitée (cosinus >= tau) réutilise la réponse en cache,
+    sans nouvel appel à Supabase ni au LLM.
+    """
+
+    def __init__(self, dim=1536, maxlen=500, ttl=300, dedup_threshold=0.95):
+        self.dim = dim
+        self.maxlen = maxlen
+        self.ttl = ttl
+        # Au-delà de ce cosinus, une nouvelle question remplace l'entrée existante au lieu d'en créer une
+        self.dedup_threshold = dedup_threshold
+        # Vecteurs stockés en FP16 (moitié moins de mémoire), comparés en produit scalaire.
+        # IndexIDMap2 permet de supprimer une entrée par son identifiant (éviction)
+        self._index = faiss.IndexIDMap2(
+            faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+        )
+        # id -> (réponse, horodatage d'insertion, clés exactes), dans l'ordre LRU
+        self._entries = OrderedDict()
+        # clé exacte (question normalisée) -> id, pour court-circuiter la recherche FAISS
+        self._keys = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vec):
+        arr = np.asarray(vec, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(arr)
+        return arr
+
+    def _expired(self, entry_id):
+        _, created_at, _ = self._entries[entry_id]
+        return time.monotonic() - created_at > self.ttl
+
+    def _remove(self, entry_id):
+        self._index.remove_ids(np.array([entry_id], dtype=np.int64))
+        _, _, keys = self._entries.pop(entry_id)
+        for key in keys:
+            if self._keys.get(key) == entry_id:
+                del self._keys[key]
+
+    def get(self, vec, tau=0.85, key=None):
+        """
+        Retourne la réponse en cache la plus proche si cosinus >= tau, sinon None.
+        Si `key` correspond exactement à une question déjà en cache, la recherche FAISS est évitée.
+        """
+        with self._lock:
+            if not self._entries:
+                return None
+
+            entry_id = self._keys.get(key) if key is not None else None
+            if entry_id is not None and self._expired(entry_id):
+                self._remove(entry_id)
+                entry_id = None
+
+            # Les voisins expirés sont supprimés au passage : on relance la recherche
+            # pour ne pas manquer une entrée encore valide au-delà de tau
+            while entry_id is None and self._entries:
+                scores, ids = self._index.search(self._normalize(vec), 1)
+                candidate_id, score = int(ids[0][0]), float(scores[0][0])
+                if candidate_id == -1 or score < tau:
+                    return None
+                if self._expired(candidate_id):
+                    self._remove(candidate_id)
+                else:
+                    entry_id = candidate_id
+
+            if entry_id is None:
+                return None
+
+            self._entries.move_to_end(entry_id)
+            return self._entries[entry_id][0]
+
+    def put(self, vec, answer, key=None):
+        """
+        Ajoute une réponse au cache, en évinçant l'entrée la moins récemment utilisée si besoin.
+        Si une question quasi identique (cosinus > dedup_threshold) est déjà en cache,
+        son entrée est mise à jour sur place plutôt que dupliquée.
+
+        En régime normal ce cas n'arrive pas : `get` sert déjà tout voisin à cosinus >= tau
+        (et purge les voisins expirés), donc `put` n'est appelé qu'après un vrai miss.
+        Il ne couvre que deux requêtes quasi identiques traitées en même temps (les deux
+        ratent le cache pendant les `await` de /ask, puis insèrent chacune leur réponse).
+        """
+        vector = self._normalize(vec)
+        with self._lock:
+            entry_id = -1
+            if self._entries:
+                scores, ids = self._index.search(vector, 1)
+                if int(ids[0][0]) != -1 and float(scores[0][0]) > self.dedup_threshold:
+                    entry_id = int(ids[0][0])
+
+            if entry_id == -1:
+                entry_id = self._next_id
+                self._next_id += 1
+                self._index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+                keys = set()
+            else:
+                _, _, keys = self._entries[entry_id]
+
+            if key is not None:
+                previous_id = self._keys.get(key)
+                if previous_id is not None and previous_id != entry_id:
+                    self._entries[previous_id][2].discard(key)
+                self._keys[key] = entry_id
+                keys.add(key)
+
+            self._entries[entry_id] = (answer, time.monotonic(), keys)
+            self._entries.move_to_end(entry_id)
+
+            while len(self._entries) > self.maxlen:
+                oldest_id = next(iter(self._entries))
+                self._remove(oldest_id)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,84 @@
+# app/vector_store.py
+import threading
+
+from langchain_core.documents import Document
+from langchain_community.vectorstores.supabase import SupabaseVectorStore
+
+from app.semantic_cache import SemanticCache
+
+
+class ThresholdSupabaseVectorStore(SupabaseVectorStore):
+    """
+    SupabaseVectorStore qui transmet un seuil de similarité à la fonction RPC
+    `match_documents` (paramètre `match_threshold`). Le filtrage est fait côté
+    serveur : seuls les documents pertinents transitent par le réseau.
+    Le `score_threshold` de LangChain, lui, n'est appliqué qu'après coup, côté client.
+
+    Les résultats de recherche sont aussi gardés en cache (SemanticCache : LRU + TTL) :
+    une requête dont l'embedding est très proche (cosinus >= cache_tau) d'une requête
+    récente réutilise les mêmes documents sans nouvel appel à Supabase.
+    """
+
+    def __init__(self, *args, match_threshold=0.0, cache_ttl=300, cache_maxlen=1000, cache_tau=0.95, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.match_threshold = match_threshold
+        self.cache_ttl = cache_ttl
+        self.cache_maxlen = cache_maxlen
+        self.cache_tau = cache_tau
+        # Un cache par jeu de paramètres de recherche (k, filtres...), créé à la demande
+        self._results_caches = {}
+        self._lock = threading.Lock()
+
+    def match_args(self, query, filter):
+        args = super().match_args(query, filter)
+        args["match_threshold"] = self.match_threshold
+        return args
+
+    def _match_documents(self, query, k, filter=None, postgrest_filter=None, score_threshold=None):
+        """
+        Appel RPC à `match_documents`, en transmettant `k` comme `match_count`.
+        La limite doit être appliquée dans la fonction SQL (ORDER BY distance LIMIT k)
+        pour que pgvector utilise l'index HNSW ; le `limit` ajouté par PostgREST
+        sur le résultat ne suffit pas.
+        """
+        match_documents_params = self.match_args(query, filter)
+        match_documents_params["match_count"] = k
+        query_builder = self._client.rpc(self.query_name, match_documents_params)
+
+        if postgrest_filter:
+            query_builder.params = query_builder.params.set("and", f"({postgrest_filter})")
+
+        query_builder.params = query_builder.params.set("limit", k)
+        res = query_builder.execute()
+
+        match_result = [
+            (
+                Document(metadata=search.get("metadata", {}), page_content=search.get("content", "")),
+                search.get("similarity", 0.0),
+            )
+            for search in res.data
+            if search.get("content")
+        ]
+
+        if score_threshold is not None:
+            match_result = [(doc, similarity) for doc, similarity in match_result if similarity >= score_threshold]
+        return match_result
+
+    def _results_cache(self, query, k, filter, postgrest_filter, kwargs):
+        params = repr((k, sorted((filter or {}).items()), postgrest_filter, sorted(kwargs.items())))
+        with self._lock:
+            cache = self._results_caches.get(params)
+            if cache is None:
+                cache = SemanticCache(dim=len(query), maxlen=self.cache_maxlen, ttl=self.cache_ttl)
+                self._results_caches[params] = cache
+            return cache
+
+    def similarity_search_by_vector_with_relevance_scores(self, query, k, filter=None, postgrest_filter=None, **kwargs):
+        cache = self._results_cache(query, k, filter, postgrest_filter, kwargs)
+        cached = cache.get(query, tau=self.cache_tau)
+        if cached is not None:
+            return list(cached)
+
+        results = self._match_documents(query, k, filter=filter, postgrest_filter=postgrest_filter, **kwargs)
+        cache.put(query, list(results))
+        return results
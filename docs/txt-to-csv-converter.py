@@ -2,6 +2,15 @@ import os
 import csv
 import re
 from math import ceil
+from concurrent.futures import ProcessPoolExecutor
+
+# Expressions régulières compilées une seule fois au chargement du module
+_FILE_RE = re.compile(r'CONTENU DE: (.*?)\.txt')
+_TITLE_RE = re.compile(r'Titre: (.*?)(?:\n|$)')
+_URL_RE = re.compile(r'URL: (.*?)(?:\n|$)')
+_ID_RE = re.compile(r'ID: (.*?)(?:\n|$)')
+_SPLIT_RE = re.compile(r'([.!?]+)')
+_TRANSCRIPT_RE = re.compile(r'TRANSCRIPTION:(.*?)(?=={2,}|$)', re.DOTALL)
 
 def split_content(content, max_length=2000):
     """
@@ -12,33 +21,39 @@ def split_content(content, max_length=2000):
         return [content]
     
     # Diviser le texte en phrases
-    sentences = re.split('([.!?]+)', content)
+    sentences = _SPLIT_RE.split(content)
     parts = []
-    current_part = ""
+    # Phrases de la partie en cours et sa taille en octets, tenue à jour au fil de l'eau
+    # (évite de ré-encoder toute la partie à chaque phrase)
+    buf = []
+    current_len = 0
     
     for i in range(0, len(sentences)-1, 2):
         sentence = sentences[i] + (sentences[i+1] if i+1 < len(sentences) else '')
-        if len((current_part + sentence).encode('utf-8')) <= max_length:
-            current_part += sentence
+        sent_len = len(sentence.encode('utf-8'))
+        if current_len + sent_len <= max_length:
+            buf.append(sentence)
+            current_len += sent_len
         else:
-            if current_part:
-                parts.append(current_part.strip())
-            current_part = sentence
+            if buf:
+                parts.append(''.join(buf).strip())
+            buf = [sentence]
+            current_len = sent_len
     
-    if current_part:
-        parts.append(current_part.strip())
+    if buf:
+        parts.append(''.join(buf).strip())
     
     return parts
 
 def extract_metadata(content):
     metadata = {}
-    file_match = re.search(r'CONTENU DE: (.*?)\.txt', content)
+    file_match = _FILE_RE.search(content)
     metadata['file_name'] = file_match.group(1) if file_match else "Unknown"
-    title_match = re.search(r'Titre: (.*?)(?:\n|$)', content)
+    title_match = _TITLE_RE.search(content)
     metadata['title'] = title_match.group(1) if title_match else ""
-    url_match = re.search(r'URL: (.*?)(?:\n|$)', content)
+    url_match = _URL_RE.search(content)
     metadata['url'] = url_match.group(1) if url_match else ""
-    id_match = re.search(r'ID: (.*?)(?:\n|$)', content)
+    id_match = _ID_RE.search(content)
     metadata['id'] = id_match.group(1) if id_match else ""
     return metadata
 
@@ -55,7 +70,7 @@ def process_txt_file(file_path):
     entries = []
     
     if is_transcript:
-        transcript_match = re.search(r'TRANSCRIPTION:(.*?)(?=={2,}|$)', content, re.DOTALL)
+        transcript_match = _TRANSCRIPT_RE.search(content)
         transcript = transcript_match.group(1).strip() if transcript_match else ""
         
         # Diviser la transcription en parties si nécessaire
@@ -115,57 +130,65 @@ def process_txt_file(file_path):
     
     return entries
 
-def write_csv_file(entries, fieldnames, output_file, max_size=4*1024*1024):
+def entry_size(entry):
     """
-    Écrit les entrées dans un fichier CSV en respectant la limite de taille
+    Taille approximative (en octets) d'une entrée une fois écrite dans le CSV
     """
-    current_size = 0
-    current_entries = []
-    header_size = len(','.join(fieldnames).encode('utf-8')) + 2
-    current_size = header_size
-    
-    for entry in entries:
-        entry_size = sum(len(str(value).encode('utf-8')) + 1 for value in entry.values())
-        if current_size + entry_size > max_size:
-            return current_entries, entries[len(current_entries):]
-        
-        current_entries.append(entry)
-        current_size += entry_size
+    return sum(len(str(value).encode('utf-8')) + 1 for value in entry.values())
+
+def write_csv_file(entries, fieldnames, output_file):
+    """
+    Écrit un lot d'entrées (déjà dimensionné) dans un fichier CSV
+    """
+    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(entries)
     
-    return current_entries, entries[len(current_entries):]
+    file_size_mb = os.path.getsize(output_file) / (1024 * 1024)
+    print(f"Fichier créé : {output_file} ({file_size_mb:.2f} Mo)")
 
-def convert_to_csv(input_folder, output_base_name):
+def convert_to_csv(input_folder, output_base_name, max_size=4*1024*1024):
+    # Liste de tuples (entrée, taille en octets) : la taille n'est calculée qu'une fois
     all_entries = []
     
-    for filename in os.listdir(input_folder):
-        if filename.endswith('.txt'):
-            file_path = os.path.join(input_folder, filename)
+    with os.scandir(input_folder) as it:
+        txt_files = [(dir_entry.name, dir_entry.path) for dir_entry in it
+                     if dir_entry.is_file() and dir_entry.name.endswith('.txt')]
+    
+    # Lecture et analyse des fichiers en parallèle (un processus par cœur),
+    # résultats récupérés dans l'ordre des fichiers
+    with ProcessPoolExecutor() as executor:
+        futures = [(filename, executor.submit(process_txt_file, file_path)) for filename, file_path in txt_files]
+        for filename, future in futures:
             print(f"Traitement du fichier : {filename}")
             try:
-                entries = process_txt_file(file_path)
-                all_entries.extend(entries)
+                entries = future.result()
+                all_entries.extend((entry, entry_size(entry)) for entry in entries)
             except Exception as e:
                 print(f"Erreur lors du traitement de {filename}: {str(e)}")
     
     if all_entries:
         fieldnames = ['type', 'file_name', 'title', 'url', 'video_id', 'chapter', 'content']
-        remaining_entries = all_entries
+        header_size = len(','.join(fieldnames).encode('utf-8')) + 2
         file_index = 1
         
-        while remaining_entries:
-            output_file = f"{output_base_name}_{file_index}.csv"
-            batch, remaining_entries = write_csv_file(remaining_entries, fieldnames, output_file)
+        # Découpage en un seul passage, en respectant la limite de taille par fichier
+        batch = []
+        current_size = header_size
+        for entry, size in all_entries:
+            if batch and current_size + size > max_size:
+                write_csv_file(batch, fieldnames, f"{output_base_name}_{file_index}.csv")
+                file_index += 1
+                batch = []
+                current_size = header_size
             
-            with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(batch)
-            
-            file_size_mb = os.path.getsize(output_file) / (1024 * 1024)
-            print(f"Fichier créé : {output_file} ({file_size_mb:.2f} Mo)")
-            file_index += 1
+            batch.append(entry)
+            current_size += size
+        
+        write_csv_file(batch, fieldnames, f"{output_base_name}_{file_index}.csv")
         
-        print(f"\nConversion terminée! {file_index-1} fichiers CSV créés")
+        print(f"\nConversion terminée! {file_index} fichiers CSV créés")
         print(f"Nombre total d'entrées : {len(all_entries)}")
     else:
         print("Aucune donnée n'a été extraite des fichiers.")
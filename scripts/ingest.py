@@ -1,11 +1,16 @@
 # scripts/ingest.py (Version finale v5 avec nettoyage et réessai automatique)
 import os
+import copy
 import time
+import uuid
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from dotenv import load_dotenv
 from supabase.client import Client, create_client
 from langchain_openai import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores.supabase import SupabaseVectorStore
 
 print("--- Début du script d'ingestion (v5 - avec réessai automatique) ---")
 
@@ -13,6 +18,9 @@ print("--- Début du script d'ingestion (v5 - avec réessai automatique) ---")
 print("1. Tentative de chargement du fichier .env...")
 load_dotenv()
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBED_CACHE_PATH = 'docs/.embed_cache.sqlite'
+
 supabase_url = os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_KEY")
 openai_api_key = os.getenv("OPENAI_API_KEY")
@@ -27,13 +35,68 @@ print("   => Clés API chargées avec succès.")
 print("\n2. Initialisation des clients (Supabase & OpenAI)...")
 try:
     supabase: Client = create_client(supabase_url, supabase_key)
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small", openai_api_key=openai_api_key)
+    embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL, openai_api_key=openai_api_key)
     print("   => Clients initialisés avec succès.")
 except Exception as e:
     print(f"\nERREUR CRITIQUE lors de l'initialisation des clients: {e}")
     exit()
 
 
+def with_retry(func, *args, label="", max_retries=5):
+    """
+    Appelle func(*args) avec réessai automatique (attente de 5s, 10s, 15s...).
+    Relève la dernière exception si toutes les tentatives échouent.
+    """
+    for attempt in range(max_retries):
+        try:
+            return func(*args)
+        except Exception as e:
+            print(f"     - AVERTISSEMENT: Erreur ({label}), tentative {attempt + 1}/{max_retries}: {e}")
+            if attempt < max_retries - 1:
+                wait_time = 5 * (attempt + 1)
+                print(f"     - Nouvel essai dans {wait_time} secondes...")
+                time.sleep(wait_time)
+            else:
+                raise
+
+
+class EmbeddingCache:
+    """
+    Cache disque (SQLite) des embeddings, indexé par sha256(modèle + texte du chunk).
+    Une ré-ingestion ne renvoie à OpenAI que les chunks nouveaux ou modifiés.
+    Les vecteurs sont stockés en FP16 (3 Ko par chunk en 1536 dimensions).
+    """
+
+    def __init__(self, path, model):
+        self.model = model
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings_fp16 (hash TEXT PRIMARY KEY, vec BLOB)")
+
+    def key(self, text):
+        return hashlib.sha256((self.model + "\x00" + text).encode('utf-8')).digest().hex()
+
+    def get_many(self, keys, chunk_size=500):
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(f"SELECT hash, vec FROM embeddings_fp16 WHERE hash IN ({placeholders})", chunk)
+            for hash_, blob in rows:
+                found[hash_] = np.frombuffer(blob, dtype=np.float16).astype(np.float32).tolist()
+        return found
+
+    def put_many(self, items):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings_fp16 (hash, vec) VALUES (?, ?)",
+            ((key, np.asarray(vec, dtype=np.float32).astype(np.float16).tobytes()) for key, vec in items),
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
 def ingest_data():
     """
     Lit les documents, les nettoie, les découpe et les stocke dans Supabase.
@@ -45,18 +108,16 @@ def ingest_data():
     print(f"\n3. Recherche et nettoyage de documents dans le dossier '{docs_path}'...")
     all_texts_with_source = []
     try:
-        filenames = os.listdir(docs_path)
+        with os.scandir(docs_path) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(('.txt', '.md')):
+                    with open(entry.path, 'r', encoding='utf-8') as f:
+                        text = f.read()
+                        cleaned_text = text.replace('\u0000', '')
+                        all_texts_with_source.append({'text': cleaned_text, 'source': entry.name})
     except FileNotFoundError:
         print(f"ERREUR: Le dossier '{docs_path}' n'a pas été trouvé.")
         return
-    
-    for filename in filenames:
-        if filename.endswith(('.txt', '.md')):
-            file_path = os.path.join(docs_path, filename)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-                cleaned_text = text.replace('\u0000', '')
-                all_texts_with_source.append({'text': cleaned_text, 'source': filename})
 
     if not all_texts_with_source:
         print("ERREUR: Aucun document valide à traiter.")
@@ -68,45 +129,83 @@ def ingest_data():
     print("\n4. Préparation et découpage des documents...")
     from langchain.docstore.document import Document
     
-    documents_to_process = [Document(page_content=item['text'], metadata={'source': item['source']}) for item in all_texts_with_source]
-    
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=1200, chunk_overlap=150)
-    docs_splitted = text_splitter.split_documents(documents_to_process)
+    # Découpage direct des textes bruts : seuls les chunks obtenus sont enveloppés dans un Document
+    docs_splitted = []
+    for item in all_texts_with_source:
+        metadata = {'source': item['source']}
+        docs_splitted.extend(
+            Document(page_content=chunk, metadata=copy.copy(metadata))
+            for chunk in text_splitter.split_text(item['text'])
+        )
     total_chunks = len(docs_splitted)
     print(f"   => Documents découpés en {total_chunks} morceaux (chunks).")
 
-    # --- Étape 5: Création des embeddings et stockage PAR LOTS avec RÉESSAI ---
-    print("\n5. Création des embeddings et stockage dans Supabase par lots...")
+    # --- Étape 5: Création des embeddings EN PARALLÈLE puis stockage PAR LOTS avec RÉESSAI ---
+    print("\n5. Création des embeddings en parallèle...")
     
-    batch_size = 40  # Réduction de la taille pour plus de stabilité
-    max_retries = 5 # Nombre maximum de tentatives par lot
+    texts = [doc.page_content for doc in docs_splitted]
+    metadatas = [doc.metadata for doc in docs_splitted]
     
-    vector_store = SupabaseVectorStore(
-        client=supabase,
-        embedding=embeddings,
-        table_name="documents",
-        query_name="match_documents"
-    )
-
-    for i in range(0, total_chunks, batch_size):
-        batch = docs_splitted[i:i + batch_size]
-        
-        for attempt in range(max_retries):
+    embed_batch_size = 100  # Textes par appel à l'API d'embedding (OpenAI accepte jusqu'à 2048)
+    insert_batch_size = 200 # Lignes par insertion dans Supabase
+    max_workers = 8 # Appels simultanés à l'API OpenAI
+    
+    # Seuls les chunks absents du cache disque sont envoyés à OpenAI
+    embed_cache = EmbeddingCache(EMBED_CACHE_PATH, EMBEDDING_MODEL)
+    keys = [embed_cache.key(text) for text in texts]
+    cached = embed_cache.get_many(set(keys))
+    todo = {}
+    for key, text in zip(keys, texts):
+        if key not in cached:
+            todo.setdefault(key, text)
+    print(f"   => {len(cached)} embedding(s) trouvé(s) dans le cache, {len(todo)} à créer.")
+    
+    todo_keys = list(todo)
+    key_groups = [todo_keys[i:i + embed_batch_size] for i in range(0, len(todo_keys), embed_batch_size)]
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(with_retry, embeddings.embed_documents, [todo[key] for key in group], label=f"embedding {n + 1}/{len(key_groups)}"): group
+            for n, group in enumerate(key_groups)
+        }
+        for future in as_completed(futures):
+            group = futures[future]
             try:
-                print(f"   - Traitement du lot {i//batch_size + 1}/{(total_chunks + batch_size - 1)//batch_size}, tentative {attempt + 1}/{max_retries}...")
-                vector_store.add_documents(batch)
-                print("     => Lot traité avec succès.")
-                break # Sortir de la boucle de réessai si c'est un succès
-            except Exception as e:
-                print(f"     - AVERTISSEMENT: Erreur lors du traitement du lot: {e}")
-                if attempt < max_retries - 1:
-                    wait_time = 5 * (attempt + 1) # Attendre 5s, 10s, 15s...
-                    print(f"     - Nouvel essai dans {wait_time} secondes...")
-                    time.sleep(wait_time)
-                else:
-                    print("\nERREUR CRITIQUE: Le nombre maximum de tentatives a été atteint pour ce lot.")
-                    print("Le script va s'arrêter.")
-                    return
+                group_vectors = future.result()
+            except Exception:
+                print("\nERREUR CRITIQUE: Le nombre maximum de tentatives a été atteint pour ce lot.")
+                print("Le script va s'arrêter.")
+                for pending in futures:
+                    pending.cancel()
+                embed_cache.close()
+                return
+            # Sauvegarde au fil de l'eau : un lot terminé n'est jamais recalculé
+            embed_cache.put_many(zip(group, group_vectors))
+            cached.update(zip(group, group_vectors))
+            print(f"   - Lot d'embeddings terminé ({len(group)} chunks).")
+    
+    embed_cache.close()
+    all_vectors = [cached[key] for key in keys]
+    print(f"   => {len(all_vectors)} embeddings prêts.")
+    
+    print("\n6. Stockage dans Supabase par lots...")
+    rows = [
+        {"id": str(uuid.uuid4()), "content": text, "metadata": metadata, "embedding": vector}
+        for text, metadata, vector in zip(texts, metadatas, all_vectors)
+    ]
+    total_batches = (len(rows) + insert_batch_size - 1) // insert_batch_size
+    
+    for i in range(0, len(rows), insert_batch_size):
+        batch = rows[i:i + insert_batch_size]
+        label = f"lot {i//insert_batch_size + 1}/{total_batches}"
+        try:
+            with_retry(lambda: supabase.table("documents").insert(batch).execute(), label=label)
+            print(f"   - {label} inséré avec succès.")
+        except Exception:
+            print("\nERREUR CRITIQUE: Le nombre maximum de tentatives a été atteint pour ce lot.")
+            print("Le script va s'arrêter.")
+            return
             
     print("\n--- Ingestion terminée avec succès ! ---")
     print("--- Fin du script ---")
@@ -0,0 +1,47 @@
+-- supabase/migrations/20261015000000_documents_embedding_hnsw.sql
+-- Index HNSW sur les embeddings + réécriture de match_documents.
+-- Sans index (ou avec IVFFlat), chaque recherche parcourt toute la table "documents" :
+-- la latence de /ask augmente avec le nombre de chunks ingérés.
+
+-- --- Index HNSW (distance cosinus) ---
+create index if not exists documents_embedding_hnsw
+    on documents using hnsw (embedding vector_cosine_ops)
+    with (m = 16, ef_construction = 64);
+
+-- --- Fonction de recherche utilisée par SupabaseVectorStore ---
+-- On supprime l'ancienne signature pour éviter une surcharge ambiguë côté PostgREST.
+drop function if exists match_documents(vector, int, jsonb);
+
+create or replace function match_documents (
+    query_embedding vector(1536),
+    -- Jamais NULL : sans LIMIT, pgvector n'utilise pas l'index HNSW (scan complet + tri)
+    match_count int default 10,
+    filter jsonb default '{}',
+    match_threshold float default 0
+) returns table (
+    id uuid,
+    content text,
+    metadata jsonb,
+    similarity float
+)
+language plpgsql
+as $$
+begin
+    -- Compromis rappel / vitesse pour le parcours du graphe HNSW (valable pour la transaction)
+    set local hnsw.ef_search = 40;
+
+    return query
+    select
+        documents.id,
+        documents.content,
+        documents.metadata,
+        1 - (documents.embedding <=> query_embedding) as similarity
+    from documents
+    where documents.metadata @> filter
+        -- Le seuil de similarité est appliqué côté serveur
+        and 1 - (documents.embedding <=> query_embedding) > match_threshold
+    -- Tri sur l'opérateur de distance brut pour que l'index HNSW soit utilisé
+    order by documents.embedding <=> query_embedding
+    limit match_count;
+end;
+$$;